@@ -1,7 +1,10 @@
+import copy
 import glob
+import os
 import pickle
 import importlib
 import logging
+from functools import lru_cache
 from pathlib import Path
 
 import yaml
@@ -37,6 +40,35 @@ RULE_TYPE_DATA = 2
 BASE_URL = "https://registry.apicrafter.io/datatype/{dataclass}"
 
 
+# Parsed rules files by filename as (modification time, rules data) pairs,
+# entry is replaced when file changes so edited files do not pile up
+_RULES_FILES_CACHE = {}
+
+
+def _load_rules_file(filename, mtime):
+    """Parses rules file. Cached by filename until modification time changes"""
+    cached = _RULES_FILES_CACHE.get(filename)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    f = open(filename, "r", encoding="utf8")
+    ruledata = yaml.load(f, Loader=yaml.FullLoader)
+    f.close()
+    _RULES_FILES_CACHE[filename] = (mtime, ruledata)
+    return ruledata
+
+
+@lru_cache(maxsize=4096)
+def _compile_ppr(rule):
+    """Compiles PyParsing rule expression. Cached by rule text"""
+    return lineStart + eval(rule) + lineEnd
+
+
+@lru_cache(maxsize=4096)
+def _compile_keywords(keywords):
+    """Compiles tuple of keywords into caseless PyParsing rule"""
+    return lineStart + oneOf(keywords, caseless=True) + lineEnd
+
+
 class TableScanResult:
     """Results of table scan classification"""
 
@@ -53,10 +85,7 @@ class TableScanResult:
         return len(self.results) == 0
 
     def asdict(self):
-        res = []
-        for m in self.results:
-            res.append(m.asdict())
-        return res
+        return [m.asdict() for m in self.results]
 
 
 class ColumnMatchResult:
@@ -76,10 +105,7 @@ class ColumnMatchResult:
         return len(self.matches) == 0
 
     def asdict(self):
-        matches = []
-        for m in self.matches:
-            matches.append(m.asdict())
-        return {"field": self.field, "matches": matches}
+        return {"field": self.field, "matches": [m.asdict() for m in self.matches]}
 
 
 class RuleResult:
@@ -94,9 +120,13 @@ class RuleResult:
         self.ruletype = ruletype
         self.is_pii = is_pii
         self.format = format
+        self._class_url = None
 
     def class_url(self):
-        return BASE_URL.format(dataclass=self.dataclass)
+        """Registry URL of the data class. Formatted once per result"""
+        if self._class_url is None:
+            self._class_url = BASE_URL.format(dataclass=self.dataclass)
+        return self._class_url
 
     def asdict(self):
         return {
@@ -129,9 +159,10 @@ class RulesProcessor:
     def import_rules(self, filename):
         """Import rules from file"""
         logging.debug("Loading rules file %s" % (filename))
-        f = open(filename, "r", encoding="utf8")
-        ruledata = yaml.load(f, Loader=yaml.FullLoader)
-        f.close()
+        # Rules are modified below, so work on a copy of the cached parse result
+        ruledata = copy.deepcopy(
+            _load_rules_file(filename, os.path.getmtime(filename))
+        )
 
         # If group of rules context or lang not in allowed list, skip it
         if self.preset_langs and ruledata["lang"] not in self.preset_langs:
@@ -151,15 +182,15 @@ class RulesProcessor:
             )
             #            print(rulekey, rule['imprecise'])
             if rule["match"] == "ppr":
-                rule["compiled"] = lineStart + eval(rule["rule"]) + lineEnd
+                rule["compiled"] = _compile_ppr(rule["rule"])
             elif rule["match"] == "func":
                 module, funcname = rule["rule"].rsplit(".", 1)
                 match_func = getattr(importlib.import_module(module), funcname)
                 rule["compiled"] = match_func
             elif rule["match"] == "text":
                 keywords = rule["rule"].split(",")
-                ruledata["rules"][rulekey]["compiled"] = (
-                    lineStart + oneOf(keywords, caseless=True) + lineEnd
+                ruledata["rules"][rulekey]["compiled"] = _compile_keywords(
+                    tuple(keywords)
                 )
                 ruledata["rules"][rulekey]["keywords"] = list(map(str.lower, keywords))
             if rule["match"] == "text":
@@ -178,14 +209,14 @@ class RulesProcessor:
                 rule["vfunc"] = match_func
             if "fieldrule" in rule.keys() and "fieldrulematch" in rule.keys():
                 if rule["fieldrulematch"] == "ppr":
-                    rule["f_compiled"] = lineStart + eval(rule["fieldrule"]) + lineEnd
+                    rule["f_compiled"] = _compile_ppr(rule["fieldrule"])
                 elif rule["fieldrulematch"] == "text":
                     keywords = rule["fieldrule"].split(",")
                     ruledata["rules"][rulekey]["fieldkeywords"] = list(
                         map(str.lower, keywords)
                     )
-                    ruledata["rules"][rulekey]["f_compiled"] = (
-                        lineStart + oneOf(keywords, caseless=True) + lineEnd
+                    ruledata["rules"][rulekey]["f_compiled"] = _compile_keywords(
+                        tuple(keywords)
                     )
             rule["id"] = rulekey
             for key in ["context", "lang"]:
@@ -444,45 +475,58 @@ class RulesProcessor:
                 #                print(field)
                 #                for rule in rules:
                 #                    print('- %s' %(rule['key']))
+                # Values are converted to strings and empty values counted once
+                # per field instead of once per rule
+                total = len(slice)
+                empty = 0
+                values = []
+                for value in slice:
+                    if value is None:
+                        if except_empty:
+                            empty += 1
+                        continue
+                    #                        if not isinstance(value, str): continue
+                    svalue = str(value)
+                    if len(svalue) == 0:
+                        if except_empty:
+                            empty += 1
+                        continue
+                    values.append(svalue)
                 for rule in rules:
-#                    print(rule)
+                    #                    print(rule)
                     success = 0
-                    empty = 0
-                    total = len(slice)
-                    for value in slice:
-                        if value is None:
-                            if except_empty:
-                                empty += 1
-                            continue
-                        #                        if not isinstance(value, str): continue
-                        slen = len(str(value))
-                        if slen == 0:
-                            if except_empty:
-                                empty += 1
-                            continue
-
-                        if slen < rule["minlen"] or slen > rule["maxlen"]:
-                            continue
-                        if rule["match"] == "func":
+                    minlen = rule["minlen"]
+                    maxlen = rule["maxlen"]
+                    if rule["match"] == "func":
+                        for svalue in values:
+                            if len(svalue) < minlen or len(svalue) > maxlen:
+                                continue
                             try:
-                                res = rule["compiled"](str(value))
+                                res = rule["compiled"](svalue)
                                 if res:
                                     success += 1
                             except KeyboardInterrupt:
                                 pass
-                        elif rule["match"] == "ppr":
+                    elif rule["match"] == "ppr":
+                        vfunc = rule.get("vfunc")
+                        for svalue in values:
+                            if len(svalue) < minlen or len(svalue) > maxlen:
+                                continue
                             try:
-                                res = rule["compiled"].parseString(str(value))
-                                if "vfunc" in rule.keys():
-                                    isvalid = rule["vfunc"](str(value))
+                                res = rule["compiled"].parseString(svalue)
+                                if vfunc is not None:
+                                    isvalid = vfunc(svalue)
                                     if isvalid:
                                         success += 1
                                 else:
                                     success += 1
                             except ParseException as e:
                                 pass
-                        elif rule["match"] == "text":
-                            if str(value).lower() in rule["keywords"]:
+                    elif rule["match"] == "text":
+                        for svalue in values:
+                            if len(svalue) < minlen or len(svalue) > maxlen:
+                                continue
+                            if svalue.lower() in rule["keywords"]:
                                 success += 1
                     if except_empty:
                         subtotal = total - empty
@@ -1,14 +1,20 @@
 # -*- coding: utf-8 -*-
 """Statistics module"""
+import codecs
 import csv
 import logging
 import zipfile
+from collections import namedtuple
 from datetime import datetime, date
+from functools import lru_cache
+from operator import mul
 
 import bson
 import orjson
 from qddate import DateParser
 
+from metacrafter.classify.utils import dict_generator
+
 DEFAULT_DICT_SHARE = 10
 SUPPORTED_FILE_TYPES = [
     "xls",
@@ -22,6 +28,7 @@ SUPPORTED_FILE_TYPES = [
     "sql",
     "bson",
 ]
+SUPPORTED_FILE_TYPES_SET = frozenset(SUPPORTED_FILE_TYPES)
 
 DEFAULT_EMPTY_VALUES = [None, "", "None", "NaN", "-", "N/A"]
 
@@ -32,11 +39,20 @@ DEFAULT_OPTIONS = {
     "empty": DEFAULT_EMPTY_VALUES,
 }
 
+# Maps every ASCII char to its class: "d" digit, "a" alpha, "s" special
+ASCII_CLASS_TABLE = str.maketrans(
+    {
+        chr(code): "d" if chr(code).isdigit() else "a" if chr(code).isalpha() else "s"
+        for code in range(128)
+    }
+)
+
 
+@lru_cache(maxsize=4096)
 def get_file_type(filename):
     """Returns is file type supported"""
     ext = filename.rsplit(".", 1)[-1].lower()
-    if ext in SUPPORTED_FILE_TYPES:
+    if ext in SUPPORTED_FILE_TYPES_SET:
         return ext
     return None
 
@@ -50,18 +66,53 @@ def get_option(options, name):
     return None
 
 
+def get_char_flags(value):
+    """Returns (has digit, has alphas, has special) flags of the string"""
+    if value.isascii():
+        classes = value.translate(ASCII_CLASS_TABLE)
+        return ("d" in classes, "a" in classes, "s" in classes)
+    return (
+        any(char.isdigit() for char in value),
+        any(char.isalpha() for char in value),
+        any(not char.isalnum() for char in value),
+    )
+
+
+# Integer size names indexed by number of bytes needed to store the value
+UINT_SIZE_NAMES = ("uint8", "uint8", "uint16", "uint32", "uint32") + ("uint64",) * 4
+INT_SIZE_NAMES = ("int8", "int8", "int16", "int32", "int32") + ("int64",) * 4
+
+
 def guess_int_size(i):
     """Identifies size of the integer"""
-    if i < 255:
-        return "uint8"
-    if i < 65535:
-        return "uint16"
-    return "uint32"
+    if i < 0:
+        # One extra bit for the sign
+        return INT_SIZE_NAMES[min(((~i).bit_length() + 8) >> 3, 8)]
+    return UINT_SIZE_NAMES[min((i.bit_length() + 7) >> 3, 8)]
+
+
+# Results for values of exact built-in types that need no further checks
+PRIMITIVE_DATATYPES = {
+    type(None): {"base": "empty"},
+    bool: {"base": "bool"},
+    int: {"base": "int"},
+    float: {"base": "float"},
+    datetime: {"base": "datetime"},
+    date: {"base": "date"},
+}
+
+# Shared results of the string checks in guess_datatype
+STR_DATATYPE = {"base": "str"}
+NUMSTR_DATATYPE = {"base": "numstr"}
+FLOAT_DATATYPE = {"base": "float"}
+EMPTY_DATATYPE = {"base": "empty"}
 
 
 def guess_datatype(value, qd_object=None):
     """Guesses type of data by string provided"""
-    attrs = {"base": "str"}
+    attrs = PRIMITIVE_DATATYPES.get(type(value))
+    if attrs is not None:
+        return attrs
     #    s = unicode(s)
     if value is None:
         return {"base": "empty"}
@@ -78,17 +129,22 @@ def guess_datatype(value, qd_object=None):
     elif not isinstance(value, str):
         #        print((type(s)))
         return {"base": "typed"}
+    return _guess_str_datatype(value, qd_object)
+
+
+def _guess_str_datatype(value, qd_object):
+    """Guesses type of the string value"""
+    attrs = STR_DATATYPE
     #    s = s.decode('utf8', 'ignore')
     if value.isdigit():
         if value[0] == "0":
-            attrs = {"base": "numstr"}
+            attrs = NUMSTR_DATATYPE
         else:
             attrs = {"base": "int", "subtype": guess_int_size(int(value))}
     else:
         try:
-            temp = float(value)
-            attrs = {"base": "float"}
-            return attrs
+            float(value)
+            return FLOAT_DATATYPE
         except ValueError:
             pass
         if qd_object:
@@ -98,34 +154,31 @@ def guess_datatype(value, qd_object=None):
                 attrs = {"base": "date", "pat": res["pattern"]}
                 is_date = True
             if not is_date:
-                if len(value.strip()) == 0:
-                    attrs = {"base": "empty"}
+                if not value or value.isspace():
+                    attrs = EMPTY_DATATYPE
     return attrs
 
 
-def dict_generator(indict, pre=None):
-    """Generates keys from dictionary"""
-    pre = pre[:] if pre else []
-    if isinstance(indict, dict):
-        for key, value in list(indict.items()):
-            if key == "_id":
-                continue
-            if isinstance(value, dict):
-                #                print 'dgen', value, key, pre
-                for d in dict_generator(value, pre + [key]):
-                    yield d
-            elif isinstance(value, list) or isinstance(value, tuple):
-                for v in value:
-                    if isinstance(v, dict):
-                        #                print 'dgen', value, key, pre
-                        for d in dict_generator(v, pre + [key]):
-                            yield d
-            #                    for d in dict_generator(v, [key] + pre):
-            #                        yield d
-            else:
-                yield pre + [key, value]
-    else:
-        yield indict
+# Row of the table returned by Analyzer.analyze, one per field
+FieldStat = namedtuple(
+    "FieldStat",
+    [
+        "key",
+        "ftype",
+        "is_dictkey",
+        "is_uniq",
+        "n_uniq",
+        "share_uniq",
+        "minlen",
+        "maxlen",
+        "avglen",
+        "tags",
+        "has_digit",
+        "has_alphas",
+        "has_special",
+        "dictvalues",
+    ],
+)
 
 
 class Analyzer:
@@ -154,6 +207,7 @@ class Analyzer:
         profile = {"version": 1.0}
         fielddata = {}
         fieldtypes = {}
+        fieldstrs = {}
 
         #    data = json.load(open(profile['filename']))
         count = 0
@@ -179,28 +233,25 @@ class Analyzer:
                     infile = z.open(fnames[0], "r")
             else:
                 finfilename = fromfile
-                if f_type == "bson":
+                encoding = get_option(options, "encoding")
+                # orjson parses UTF-8 bytes directly, skip decoding JSON lines
+                if f_type == "bson" or (
+                    f_type == "jsonl"
+                    and encoding is not None
+                    and codecs.lookup(encoding).name == "utf-8"
+                ):
                     infile = open(fromfile, "rb")
                 else:
-                    infile = open(
-                        fromfile, "r", encoding=get_option(options, "encoding")
-                    )
-
-            # Identify item list
-            itemlist = []
+                    infile = open(fromfile, "r", encoding=encoding)
 
+            # Identify item list. Records are streamed from file, not loaded
             if f_type == "jsonl":
-                for l in infile:
-                    itemlist.append(orjson.loads(l))
+                itemlist = map(orjson.loads, infile)
             elif f_type == "csv":
                 delimiter = get_option(options, "delimiter")
-                reader = csv.DictReader(infile, delimiter=delimiter)
-                for r in reader:
-                    itemlist.append(r)
+                itemlist = csv.DictReader(infile, delimiter=delimiter)
             elif f_type == "bson":
-                bson_iter = bson.decode_file_iter(infile)
-                for r in bson_iter:
-                    itemlist.append(r)
+                itemlist = bson.decode_file_iter(infile)
 
         # process data items one by one
         if fromfile is not None:
@@ -222,8 +273,9 @@ class Analyzer:
                 if len(i[0]) == 1:
                     continue
                 v = i[-1]
-                if k not in list(fielddata.keys()):
-                    fielddata[k] = {
+                fd = fielddata.get(k)
+                if fd is None:
+                    fd = fielddata[k] = {
                         "key": k,
                         "uniq": {},
                         "n_uniq": 0,
@@ -237,41 +289,46 @@ class Analyzer:
                         "has_alphas": 0,
                         "has_special": 0,
                     }
-                fd = fielddata[k]                
-                val_s = str(v)
-                uniqval = fd["uniq"].get(val_s, 0)
-                fd["uniq"][val_s] = uniqval + 1
-                fd["total"] += 1
-                if uniqval == 0:
-                    fd["n_uniq"] += 1
-                    fd["share_uniq"] = (fd["n_uniq"] * 100.0) / fd["total"]
-                fl = len(str(v))
-                if fd["minlen"] is None:
-                    fd["minlen"] = fl
-                else:
-                    fd["minlen"] = fl if fl < fd["minlen"] else fd["minlen"]
-                fd["maxlen"] = fl if fl > fd["maxlen"] else fd["maxlen"]
-                fd["totallen"] += fl
-                fielddata[k] = fd
-                if k not in list(fieldtypes.keys()):
                     fieldtypes[k] = {"key": k, "types": {}}
+                val_s = str(v)
+                uniq = fd["uniq"]
+                uniq[val_s] = uniq.get(val_s, 0) + 1
                 fd = fieldtypes[k]
+                if isinstance(v, str):
+                    # String values are typed once per distinct value below
+                    strvals = fieldstrs.setdefault(k, {})
+                    strvals[v] = strvals.get(v, 0) + 1
+                    continue
                 thetype = guess_datatype(v, self.qd)["base"]
-                if thetype == "str":
-                    fielddata[k]["has_digit"] += (
-                        1 if any(char.isdigit() for char in v) else 0
-                    )
-                    fielddata[k]["has_alphas"] += (
-                        1 if any(char.isalpha() for char in v) else 0
-                    )
-                    fielddata[k]["has_special"] += (
-                        1 if any(not char.isalnum() for char in v) else 0
-                    )
                 uniqval = fd["types"].get(thetype, 0)
                 fd["types"][thetype] = uniqval + 1
                 fieldtypes[k] = fd
+        if fromfile:
+            infile.close()
+        # Types of distinct strings, shared between fields of this file only
+        strtypes = {}
+        for k, strvals in fieldstrs.items():
+            fd = fielddata[k]
+            types = fieldtypes[k]["types"]
+            for v, n in strvals.items():
+                thetype = strtypes.get(v)
+                if thetype is None:
+                    thetype = strtypes[v] = _guess_str_datatype(v, self.qd)["base"]
+                if thetype == "str":
+                    has_digit, has_alphas, has_special = get_char_flags(v)
+                    fd["has_digit"] += n if has_digit else 0
+                    fd["has_alphas"] += n if has_alphas else 0
+                    fd["has_special"] += n if has_special else 0
+                types[thetype] = types.get(thetype, 0) + n
         #        print count
         for k, v in list(fielddata.items()):
+            # Length stats are computed over distinct values weighted by counts
+            lengths = [len(val_s) for val_s in v["uniq"]]
+            v["minlen"] = min(lengths)
+            v["maxlen"] = max(lengths)
+            v["totallen"] = sum(map(mul, lengths, v["uniq"].values()))
+            v["n_uniq"] = len(v["uniq"])
+            v["total"] = sum(v["uniq"].values())
             fielddata[k]["share_uniq"] = (v["n_uniq"] * 100.0) / v["total"]
             fielddata[k]["avglen"] = v["totallen"] / v["total"]
         profile["count"] = count
@@ -304,7 +361,7 @@ class Analyzer:
                 dicts[fd["key"]] = {
                     "items": fd["uniq"],
                     "count": fd["n_uniq"],
-                    "total": sum(fd["uniq"].values()),
+                    "total": fd["total"],
                     "type": finfields[fd["key"]],
                 }  # TODO: Shouldn't be "str" by default
         #            for k, v in fd['uniq'].items():
@@ -314,35 +371,35 @@ class Analyzer:
         profile["debug"] = {"fieldtypes": fieldtypes.copy(), "fielddata": fielddata}
         profile["fieldtypes"] = finfields
         table = []
+        empty_values = set(options["empty"])
         for fd in list(fielddata.values()):
-            field = [
-                fd["key"],
-            ]
-            field.append(finfields[fd["key"]])
-            field.append(True if fd["key"] in dictkeys else False)
-            field.append(False if fd["share_uniq"] < 100 else True)
-            field.append(fd["n_uniq"])
-            field.append(fd["share_uniq"])
-            field.append(fd["minlen"])
-            field.append(fd["maxlen"])
-            field.append(fd["avglen"])
             tags = []
             if fd["share_uniq"] == 100:
                 tags.append("uniq")
-            allempty = 0
-            if fd["key"] in dicts.keys():
-                for key, value in dicts[fd["key"]]["items"].items():
-                    if key in options["empty"]:
-                        allempty += value
+            if fd["key"] in dicts:
+                # Look up empty values instead of scanning all dict items
+                items = dicts[fd["key"]]["items"]
+                allempty = sum(items.get(key, 0) for key in empty_values)
                 if allempty == dicts[fd["key"]]["total"]:
                     tags.append("empty")
                 else:
                     tags.append("dict")
-            field.append(tags)
-            field.append(fd["has_digit"])
-            field.append(fd["has_alphas"])
-            field.append(fd["has_special"])
-            field.append(list(fd["uniq"].keys()) if fd["key"] in dictkeys else None)
+            field = FieldStat(
+                fd["key"],
+                finfields[fd["key"]],
+                fd["key"] in dicts,
+                False if fd["share_uniq"] < 100 else True,
+                fd["n_uniq"],
+                fd["share_uniq"],
+                fd["minlen"],
+                fd["maxlen"],
+                fd["avglen"],
+                tags,
+                fd["has_digit"],
+                fd["has_alphas"],
+                fd["has_special"],
+                list(fd["uniq"].keys()) if fd["key"] in dicts else None,
+            )
             table.append(field)
         return table
 
@@ -1,75 +1,109 @@
 # -*- coding: utf-8 -*-
 """Utility functions that help to work with data"""
-import chardet
-from collections import defaultdict, OrderedDict
+import codecs
+import sys
+from chardet import UniversalDetector
+from collections import Counter, defaultdict, OrderedDict
+from itertools import chain
 import xmltodict
 
 
+# Keys skipped when walking records, like MongoDB object ids
+SKIP_KEYS = frozenset(["_id"])
+
+
 def dict_generator(indict, pre=None):
     """Generates schema from dictionary object"""
-    pre = pre[:] if pre else []
-    if isinstance(indict, dict):
-        for key, value in list(indict.items()):
-            if key == "_id":
+    if not isinstance(indict, dict):
+        yield indict
+        return
+    # Depth-first walk with an explicit stack of item iterators and a shared
+    # key path, each leaf is yielded as (*path, key, value) tuple
+    path = list(pre) if pre else []
+    stack = [iter(indict.items())]
+    while stack:
+        for key, value in stack[-1]:
+            if key in SKIP_KEYS:
                 continue
             if isinstance(value, dict):
-                #                print 'dgen', value, key, pre
-                for d in dict_generator(value, pre + [key]):
-                    yield d
+                path.append(key)
+                stack.append(iter(value.items()))
+                break
             elif isinstance(value, list) or isinstance(value, tuple):
-                for v in value:
-                    if isinstance(v, dict):
-                        #                print 'dgen', value, key, pre
-                        for d in dict_generator(v, pre + [key]):
-                            yield d
-            #                    for d in dict_generator(v, [key] + pre):
-            #                        yield d
+                # Only dict items of lists are walked, all under the same key
+                path.append(key)
+                stack.append(
+                    chain.from_iterable(v.items() for v in value if isinstance(v, dict))
+                )
+                break
             else:
-                yield pre + [key, value]
-    else:
-        yield indict
+                yield (*path, key, value)
+        else:
+            stack.pop()
+            if stack:
+                path.pop()
 
 
-def headers(data, limit=1000):
-    """Returns headers of list of dict objects"""
+def headers(data, limit=1000, stability_window=None):
+    """Returns headers of list of dict objects.
+
+    If stability_window is set, stops after that many consecutive items
+    add no new keys. Counting starts with the first item that has keys.
+    """
     iter_num = 0
+    stable = 0
     keys = []
+    # Set for membership checks, list keeps order keys were found
+    seen = set()
     for item in data:
         iter_num += 1
         if iter_num > limit:
             break
+        nkeys = len(keys)
         dict_gen = dict_generator(item)
         for i in dict_gen:
-            k = ".".join(i[:-1])
-            if k not in keys:
+            k = sys.intern(".".join(i[:-1]))
+            if k not in seen:
+                seen.add(k)
                 keys.append(k)
+        if stability_window is not None and keys:
+            stable = stable + 1 if len(keys) == nkeys else 0
+            if stable >= stability_window:
+                break
     return keys
 
 
 def get_dict_value(object, keys):
     """Returns single value from dictionary object"""
-    out = []
     if object is None:
-        return out
-    #    keys = key.split('.')
-    if len(keys) == 1:
-        if isinstance(object, dict):
-            if keys[0] in object.keys():
-                out.append(object[keys[0]])
-        else:
-            for record in object:
-                if record and keys[0] in record.keys():
-                    out.append(record[keys[0]])
-    #        return out
+        return []
+    # Nested dicts are followed directly while the path stays in them
+    depth = 0
+    for key in keys:
+        if not isinstance(object, dict):
+            break
+        if key not in object:
+            return []
+        object = object[key]
+        depth += 1
     else:
-        if isinstance(object, dict):
-            if keys[0] in object.keys():
-                out.extend(get_dict_value(object[keys[0]], keys[1:]))
-        else:
-            for record in object:
-                if keys[0] in record.keys():
-                    out.extend(get_dict_value(record[keys[0]], keys[1:]))
-    return out
+        return [object]
+    # Walk the rest level by level, lists of records are expanded in place
+    nodes = [object]
+    for key in keys[depth:]:
+        found = []
+        for node in nodes:
+            if node is None:
+                continue
+            if isinstance(node, dict):
+                if key in node:
+                    found.append(node[key])
+            else:
+                for record in node:
+                    if record and key in record:
+                        found.append(record[key])
+        nodes = found
+    return nodes
 
 
 def dict_to_columns(data):
@@ -78,84 +112,175 @@ def dict_to_columns(data):
     for row in data:
         dk = dict_generator(row)
         for i in dk:
-            k = ".".join(i[:-1])
-            if k in columns.keys():
-                columns[k].append(i[-1])
+            # Same dotted keys repeat for every row, share one interned string
+            k = sys.intern(".".join(i[:-1]))
+            column = columns.get(k)
+            if column is None:
+                columns[k] = [i[-1]]
             else:
-                columns[k] = [
-                    i[-1],
-                ]
+                column.append(i[-1])
     return columns
 
 
 def string_to_charrange(s):
     """Returns array of chars from string"""
-    chars = {}
-    for ch in s:
-        v = chars.get(ch, 0)
-        chars[ch] = v + 1
-    return chars
+    return dict(Counter(s))
 
 
 def string_array_to_charrange(sarr):
     """Returns char map from array"""
-    chars = {}
-    for s in sarr:
-        for ch in s:
-            v = chars.get(ch, 0)
-            chars[ch] = v + 1
-    return chars
+    return string_to_charrange("".join(sarr))
+
+
+ENCODING_CHUNK_SIZE = 8192
+
+# Byte order marks, UTF-32 ones go first since they start with UTF-16 ones
+ENCODING_BOMS = (
+    (codecs.BOM_UTF8, "UTF-8-SIG"),
+    (codecs.BOM_UTF32_LE, "UTF-32"),
+    (codecs.BOM_UTF32_BE, "UTF-32"),
+    (codecs.BOM_UTF16_LE, "UTF-16"),
+    (codecs.BOM_UTF16_BE, "UTF-16"),
+)
+
+
+# Printable ASCII plus tab, LF, FF and CR. Anything else (NUL and other
+# control bytes, ESC of ISO-2022, high bytes) is left to the detector
+PLAIN_ASCII_BYTES = bytes(range(0x20, 0x7F)) + b"\t\n\x0c\r"
+
+
+def _is_plain_ascii(chunk):
+    """Returns true if chunk is plain ASCII text and not HZ (~{) encoded"""
+    return not chunk.translate(None, PLAIN_ASCII_BYTES) and b"~{" not in chunk
+
+
+def _encoding_result(encoding):
+    """Returns text encoding detection result in the detector's dict shape"""
+    return {
+        "encoding": encoding,
+        "confidence": 1.0,
+        "language": "",
+        "mime_type": "text/plain",
+    }
 
 
 def detect_encoding(filename, limit=1000000):
     """Detects encoding of the filename"""
-    f = open(filename, "rb")
-    chunk = f.read(limit)
-    f.close()
-    detected = chardet.detect(chunk)
-    return detected
+    detector = UniversalDetector()
+    with open(filename, "rb") as f:
+        chunk = f.read(min(ENCODING_CHUNK_SIZE, limit))
+        for bom, encoding in ENCODING_BOMS:
+            if chunk.startswith(bom):
+                return _encoding_result(encoding)
+        # Plain ASCII text sample needs no detector, translate() is a C scan
+        ascii_chunks = []
+        fed = 0
+        tail = b""
+        while chunk and _is_plain_ascii(tail + chunk):
+            ascii_chunks.append(chunk)
+            # Last byte of the chunk, "~{" may be split between chunks
+            tail = chunk[-1:]
+            fed += len(chunk)
+            chunk = f.read(min(ENCODING_CHUNK_SIZE, limit - fed)) if fed < limit else b""
+        if fed and not chunk:
+            return _encoding_result("ascii")
+        if ascii_chunks:
+            detector.feed(b"".join(ascii_chunks))
+        # Feed detector by chunks and stop as soon as it is confident
+        while chunk:
+            fed += len(chunk)
+            detector.feed(chunk)
+            if detector.done or fed >= limit:
+                break
+            chunk = f.read(min(ENCODING_CHUNK_SIZE, limit - fed))
+    detector.close()
+    # Older chardet versions have no mime_type, keep one result shape
+    result = dict(detector.result)
+    result.setdefault("mime_type", None)
+    return result
+
+
+DELIMITER_SAMPLE_SIZE = 32768
+DELIMITER_SAMPLE_LINES = 50
+# Candidates in order of preference when scores are equal
+DELIMITERS = (",", ";", "\t", "|")
 
 
 def detect_delimiter(filename, encoding="utf8"):
-    """Detects CSV file delimiter by first line"""
-    f = open(filename, "r", encoding=encoding)
-    line = f.readline()
-    f.close()
-    dict1 = {
-        ",": line.count(","),
-        ";": line.count(";"),
-        "\t": line.count("\t"),
-        "|": line.count("|"),
-    }
-    delimiter = max(dict1, key=dict1.get)
-    return delimiter
+    """Detects CSV file delimiter by its counts on the first lines"""
+    encoding = encoding or "utf8"
+    with open(filename, "rb") as f:
+        sample = f.read(DELIMITER_SAMPLE_SIZE)
+    truncated = len(sample) == DELIMITER_SAMPLE_SIZE
+    # Always decode, in multibyte encodings like Shift_JIS trail bytes may
+    # match delimiter bytes. Incremental decoder keeps a multibyte char cut
+    # at the sample end pending instead of failing on it
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    sample = decoder.decode(sample, final=False)
+    if truncated and "\n" in sample:
+        # Drop last incomplete line
+        sample = sample[: sample.rindex("\n")]
+    lines = [
+        line
+        for line in sample.split("\n", DELIMITER_SAMPLE_LINES)[
+            :DELIMITER_SAMPLE_LINES
+        ]
+        if line.strip()
+    ]
+    # Prefer delimiter found same number of times on the most lines, then
+    # the one with more columns
+    best, best_score = DELIMITERS[0], (0, 0)
+    for delimiter in DELIMITERS:
+        counts = Counter(line.count(delimiter) for line in lines)
+        counts.pop(0, None)
+        if not counts:
+            continue
+        score = max((nlines, num) for num, nlines in counts.items())
+        if score > best_score:
+            best, best_score = delimiter, score
+    return best
 
 
 def etree_to_dict(t, prefix_strip=True):
     """Lxml etree converted to Python dictionary for JSON serialization"""
-    tag = t.tag if not prefix_strip else t.tag.rsplit("}", 1)[-1]
-    d = {tag: {} if t.attrib else None}
-    children = list(t)
-    if children:
-        dd = defaultdict(list)
-        for dc in map(etree_to_dict, children):
-            #            print(dir(dc))
-            for k, v in dc.items():
-                if prefix_strip:
-                    k = k.rsplit("}", 1)[-1]
-                dd[k].append(v)
-        d = {tag: {k: v[0] if len(v) == 1 else v for k, v in dd.items()}}
-    if t.attrib:
-        d[tag].update(("@" + k.rsplit("}", 1)[-1], v) for k, v in t.attrib.items())
-    if t.text:
-        text = t.text.strip()
-        if children or t.attrib:
-            tag = tag.rsplit("}", 1)[-1]
-            if text:
-                d[tag]["#text"] = text
+    # Tags repeat across elements, interned keys share one string
+    tag = sys.intern(t.tag if not prefix_strip else t.tag.rsplit("}", 1)[-1])
+    # Post-order walk with explicit stack of (element, children iterator,
+    # converted children grouped by tag, tag)
+    stack = [(t, iter(t), defaultdict(list), tag)]
+    while stack:
+        elem, children, dd, tag = stack[-1]
+        for child in children:
+            stack.append(
+                (
+                    child,
+                    iter(child),
+                    defaultdict(list),
+                    sys.intern(child.tag.rsplit("}", 1)[-1]),
+                )
+            )
+            break
         else:
-            d[tag] = text
-    return d
+            stack.pop()
+            if dd:
+                value = {k: v[0] if len(v) == 1 else v for k, v in dd.items()}
+            else:
+                value = {} if elem.attrib else None
+            if elem.attrib:
+                value.update(
+                    (sys.intern("@" + k.rsplit("}", 1)[-1]), v)
+                    for k, v in elem.attrib.items()
+                )
+            if elem.text:
+                text = elem.text.strip()
+                if dd or elem.attrib:
+                    if text:
+                        value["#text"] = text
+                else:
+                    value = text
+            if not stack:
+                return {tag: value}
+            stack[-1][2][tag].append(value)
 
 
 def _seek_xml_lists(data, level=0, path=None, candidates=OrderedDict()):
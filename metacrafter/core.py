@@ -3,8 +3,10 @@
 import json
 import logging
 import os
+from functools import lru_cache
 
 
+import orjson
 import typer
 
 import qddate
@@ -12,11 +14,7 @@ import qddate.patterns
 import yaml
 from tabulate import tabulate
 
-import requests
-
-from iterable.helpers.detect import open_iterable
-
-from metacrafter.classify.processor import RulesProcessor, BASE_URL
+from metacrafter.classify.processor import RulesProcessor
 from metacrafter.classify.stats import Analyzer
 
 
@@ -25,6 +23,11 @@ SUPPORTED_FILE_TYPES = ["jsonl", "bson", "csv", "tsv", "json", "xml", 'ndjson',
 CODECS = ["lz4", 'gz', 'xz', 'bz2', 'zst', 'br', 'snappy']
 BINARY_DATA_FORMATS = ["bson", "parquet"]
 
+# JSON formatting of scan reports written to output files
+REPORT_DUMP_OPTIONS = (
+    orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS | orjson.OPT_APPEND_NEWLINE
+)
+
 DEFAULT_METACRAFTER_CONFIGFILE = ".metacrafter"
 DEFAULT_RULEPATH = [
     "rules",
@@ -42,6 +45,27 @@ server_app = typer.Typer()
 app.add_typer(server_app, name='server')
 
 
+@lru_cache(maxsize=None)
+def _get_date_parser():
+    """Returns date parser shared by all commands. Patterns compiled once"""
+    return qddate.DateParser(
+        patterns=qddate.patterns.PATTERNS_EN + qddate.patterns.PATTERNS_RU
+    )
+
+
+def _sqlite_text_factory(data):
+    """Decodes SQLite TEXT values, replacing invalid UTF-8 sequences"""
+    try:
+        return data.decode("utf8")
+    except UnicodeDecodeError:
+        return data.decode("utf8", errors="replace")
+
+
+def _set_sqlite_text_factory(dbapi_connection, connection_record):
+    """Installs tolerant text factory on each new SQLite connection"""
+    dbapi_connection.text_factory = _sqlite_text_factory
+
+
 class CrafterCmd(object):
     def __init__(self, remote:str=None, debug:bool=False):
         # logging.getLogger().addHandler(logging.StreamHandler())
@@ -81,9 +105,7 @@ class CrafterCmd(object):
             rulepath = DEFAULT_RULEPATH
         for rp in rulepath:
             self.processor.import_rules_path(rp, recursive=True)
-        self.dparser = qddate.DateParser(
-            patterns=qddate.patterns.PATTERNS_EN + qddate.patterns.PATTERNS_RU
-        )
+        self.dparser = _get_date_parser()
 
     def rules_list(self):
         """Rules list"""
@@ -127,14 +149,11 @@ class CrafterCmd(object):
     def _write_results(self, prepared, results, filename, dformat, output):
         if output:
             if isinstance(output, str):
-                f = open(output, "w", encoding="utf8")
-                out = []
+                f = open(output, "wb")
                 f.write(
-                    json.dumps(
+                    orjson.dumps(
                         {"table": filename, "fields": results},
-                        indent=4,
-                        sort_keys=True,
-                        ensure_ascii=False,
+                        option=REPORT_DUMP_OPTIONS,
                     )
                 )
                 f.close()
@@ -187,12 +206,16 @@ class CrafterCmd(object):
                     print()
         if output:
             print("Output written to %s" % (output))
-            f = open(output, "w", encoding="utf8")
-            f.write(json.dumps(out, indent=4, sort_keys=True))
+            f = open(output, "wb")
+            f.write(
+                orjson.dumps(out, option=REPORT_DUMP_OPTIONS)
+            )
             f.close()
 
 
     def scan_data_client(self, api_root, items, limit=1000, contexts=None, langs=None):
+        import requests
+
         params = {'langs' : ','.join(langs) if langs else None, 'contexts' : ','.join(contexts) if contexts else None}
 
         url = api_root + '/api/v1/scan_data'
@@ -214,28 +237,9 @@ class CrafterCmd(object):
             itemlist=items,
             options={"delimiter": ",", "format_in": None, "zipfile": None},
         )
-        headers = [
-            "key",
-            "ftype",
-            "is_dictkey",
-            "is_uniq",
-            "n_uniq",
-            "share_uniq",
-            "minlen",
-            "maxlen",
-            "avglen",
-            "tags",
-            "has_digit",
-            "has_alphas",
-            "has_special",
-            "dictvalues",
-        ]
         datastats_dict = {}
         for row in datastats:
-            #            print(row)
-            datastats_dict[row[0]] = {}
-            for n in range(0, len(headers)):
-                datastats_dict[row[0]][headers[n]] = row[n]
+            datastats_dict[row.key] = row._asdict()
 
         results = self.processor.match_dict(
             items,
@@ -264,7 +268,7 @@ class CrafterCmd(object):
                     datastats_dict[res.field]["ftype"],
                     ",".join(datastats_dict[res.field]["tags"]),
                     ",".join(matches),
-                    BASE_URL.format(dataclass=res.matches[0].dataclass)
+                    res.matches[0].class_url()
                     if len(res.matches) > 0
                     else "",
                 ]
@@ -273,7 +277,7 @@ class CrafterCmd(object):
             record["tags"] = datastats_dict[res.field]["tags"]
             record["ftype"] = datastats_dict[res.field]["ftype"]
             record["datatype_url"] = (
-                BASE_URL.format(dataclass=res.matches[0].dataclass)
+                res.matches[0].class_url()
                 if len(res.matches) > 0
                 else ""
             )
@@ -296,6 +300,8 @@ class CrafterCmd(object):
         dformat="short",
         output=None,
     ):
+        from iterable.helpers.detect import open_iterable
+
         iterableargs = {}
         if tagname is not None:
             iterableargs['tagname'] = tagname
@@ -359,12 +365,16 @@ class CrafterCmd(object):
         output=None,
     ):
         """SQL alchemy way to scan any database"""
-        from sqlalchemy import create_engine, inspect
+        from sqlalchemy import create_engine, event, inspect
         import sqlalchemy.exc
 
         dbtype = connectstr.split(":", 1)[0].lower()
         print("Connecting to %s" % (connectstr))
-        dbe = create_engine(connectstr)
+        # Pre-ping detects connections dropped by the server before they are
+        # used, recycle avoids handing out connections past typical timeouts
+        dbe = create_engine(connectstr, pool_pre_ping=True, pool_recycle=3600)
+        if dbe.dialect.name == "sqlite":
+            event.listen(dbe, "connect", _set_sqlite_text_factory)
         inspector = inspect(dbe)
         db_schemas = inspector.get_schema_names()
         con = dbe.connect()
@@ -377,19 +387,36 @@ class CrafterCmd(object):
                 con.execute("SET search_path TO {schema}".format(schema=schema))
             for table in inspector.get_table_names(schema=schema):
                 print("- table %s" % (table))
+                query = "SELECT * FROM '%s' LIMIT %d" % (table, limit)
                 try:
-                    query = "SELECT * FROM '%s' LIMIT %d" % (table, limit)
-                    queryres = con.execute(query)
+                    for attempt in range(2):
+                        try:
+                            # Server-side cursor where the driver supports it,
+                            # rows are converted as they arrive
+                            queryres = con.execution_options(
+                                stream_results=True
+                            ).execute(query)
+                            items = [dict(u) for u in queryres]
+                            break
+                        except sqlalchemy.exc.OperationalError as e:
+                            # Retry once if connection was lost in the middle
+                            if attempt > 0 or not e.connection_invalidated:
+                                raise
+                            logging.debug("Connection lost, retrying table %s" % (table))
+                            if dbtype == "postgres":
+                                con.execute(
+                                    "SET search_path TO {schema}".format(schema=schema)
+                                )
                 except sqlalchemy.exc.ProgrammingError as e:
                     print("Error processing table %s: %s" % (table, str(e)))
                     continue
-                items = [dict(u) for u in queryres.fetchall()]
                 if self.remote is None:
                     report = self.scan_data(items, limit, contexts, langs)      
                 else:
                     report = self.scan_data_client(self.remote, items, limit, contexts, langs)                      
                 db_results[table] = [report['results'], report['data']]
         self._write_db_results(db_results, dformat, output)
+        return db_results
 
 
 
@@ -1,9 +1,17 @@
 # -*- coding: utf-8 -*-
+from functools import lru_cache
+
 import requests
 
 BASE_REGISTRY_URL = "https://registry.apicrafter.io"
 
 
+@lru_cache(maxsize=None)
+def _load_registry(connstr):
+    """Downloads full registry once per process and registry URL"""
+    return requests.get(connstr + "/registry.json").json()
+
+
 class RegistryClient:
     """Client to access semantic data types registry"""
 
@@ -15,7 +23,7 @@ class RegistryClient:
 
     def preload(self):
         """Preloads all semantic data types from registry"""
-        self.cached = requests.get(self.connstr + "/registry.json").json()
+        self.cached = _load_registry(self.connstr)
 
     def getlist(self):
         """List all semantic types ids"""
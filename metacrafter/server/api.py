@@ -9,7 +9,7 @@ from flask import (
 )
 
 from metacrafter.classify.stats import Analyzer
-from ..classify.processor import RulesProcessor, BASE_URL
+from ..classify.processor import RulesProcessor
 
 RULES_PROCESSOR = None
 DATE_PARSER = None
@@ -73,28 +73,9 @@ def scan_data():
             itemlist=items,
             options={"delimiter": ",", "format_in": None, "zipfile": None},
         )
-        headers = [
-            "key",
-            "ftype",
-            "is_dictkey",
-            "is_uniq",
-            "n_uniq",
-            "share_uniq",
-            "minlen",
-            "maxlen",
-            "avglen",
-            "tags",
-            "has_digit",
-            "has_alphas",
-            "has_special",
-            "dictvalues",
-        ]
         datastats_dict = {}
         for row in datastats:
-            #            print(row)
-            datastats_dict[row[0]] = {}
-            for n in range(0, len(headers)):
-                datastats_dict[row[0]][headers[n]] = row[n]
+            datastats_dict[row.key] = row._asdict()
 
         results = RULES_PROCESSOR.match_dict(
             items,
@@ -126,7 +107,7 @@ def scan_data():
                     datastats_dict[res.field]["ftype"],
                     ",".join(datastats_dict[res.field]["tags"]),
                     ",".join(matches),
-                    BASE_URL.format(dataclass=res.matches[0].dataclass)
+                    res.matches[0].class_url()
                     if len(res.matches) > 0
                     else "",
                 ]
@@ -135,7 +116,7 @@ def scan_data():
             record["tags"] = datastats_dict[res.field]["tags"]
             record["ftype"] = datastats_dict[res.field]["ftype"]
             record["datatype_url"] = (
-                BASE_URL.format(dataclass=res.matches[0].dataclass)
+                res.matches[0].class_url()
                 if len(res.matches) > 0
                 else ""
             )
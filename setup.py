@@ -97,12 +97,12 @@ setup(
     tests_require=tests_require,
     cmdclass={'test': PyTest},
     zip_safe=False,
+    python_requires='>=3.7',
     keywords='json jsonl csv bson cli dataset metadata',
     classifiers=[
         'Development Status :: 5 - Production/Stable',
         'Programming Language :: Python',
         'Programming Language :: Python :: 3 :: Only',
-        'Programming Language :: Python :: 3.6',
         'Programming Language :: Python :: 3.7',
         'Programming Language :: Python :: 3.8',
         'Programming Language :: Python :: 3.9',
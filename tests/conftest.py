@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+import pytest
+from metacrafter.registry.client import RegistryClient
+
+
+@pytest.fixture(scope="session")
+def preloaded_client():
+    """Registry client preloaded once for the whole test session"""
+    return RegistryClient(preload=True)
@@ -27,20 +27,20 @@ class TestRegistry:
         client = RegistryClient(preload=False)
         assert len(client.getlist()) > 0
 
-    def test_registry_has(self):
-        client = RegistryClient(preload=True)
+    def test_registry_has(self, preloaded_client):
+        client = preloaded_client
         assert client.has('year')
         assert client.has('month')
         assert not client.has('notexists')
 
-    def test_registry_get(self):
-        client = RegistryClient(preload=True)
+    def test_registry_get(self, preloaded_client):
+        client = preloaded_client
         assert client.get('year')['name'] == 'Year'
         assert client.get('url')['id'] == 'url'
         assert client.get('birthday')['is_pii'] == True
         assert client.get('inn')['is_pii'] == False
 
-    def test_registry_get_error(self):
-        client = RegistryClient(preload=True)
+    def test_registry_get_error(self, preloaded_client):
+        client = preloaded_client
         with pytest.raises(KeyError):
             item = client.get('notexists')
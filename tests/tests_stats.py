@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+from metacrafter.classify.stats import Analyzer, guess_int_size
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+class TestAnalyzer:
+    @pytest.mark.parametrize("filename", ["2cols6rows_flat.jsonl", "books.jsonl"])
+    def test_analyze_jsonl_no_encoding(self, filename):
+        options = {
+            "delimiter": ",",
+            "format_in": None,
+            "zipfile": None,
+            "encoding": None,
+        }
+        table = Analyzer().analyze(
+            fromfile=os.path.join(FIXTURES_DIR, filename), options=options
+        )
+        assert len(table) > 0
+
+
+class TestGuessIntSize:
+    @pytest.mark.parametrize(
+        "value,expected",
+        [
+            (0, "uint8"),
+            (255, "uint8"),
+            (256, "uint16"),
+            (65535, "uint16"),
+            (65536, "uint32"),
+            (2**32 - 1, "uint32"),
+            (2**32, "uint64"),
+            (-128, "int8"),
+            (-129, "int16"),
+        ],
+    )
+    def test_boundaries(self, value, expected):
+        assert guess_int_size(value) == expected
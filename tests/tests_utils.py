@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+import os
+from xml.etree import ElementTree
+
+import pytest
+from metacrafter.classify.utils import (
+    detect_delimiter,
+    detect_encoding,
+    etree_to_dict,
+    get_dict_value,
+    headers,
+)
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+class TestHeaders:
+    def test_stability_window_stops(self):
+        data = iter([{"a": 1}] * 5 + [{"b": 2}])
+        assert headers(data, stability_window=3) == ["a"]
+        # Stopped right after the window, rest of the items are not consumed
+        assert next(data) == {"a": 1}
+
+    def test_stability_window_late_key(self):
+        data = [{}] * 5 + [{"a": 1}] + [{"a": 1, "b": {"c": 2}}]
+        assert headers(data, stability_window=3) == ["a", "b.c"]
+
+
+class TestGetDictValue:
+    def test_dict_path(self):
+        assert get_dict_value({"a": {"b": {"c": 1}}}, ["a", "b", "c"]) == [1]
+
+    def test_list_with_none_record(self):
+        data = {"a": [{"b": 1}, None, {"b": 2}, {"c": 3}]}
+        assert get_dict_value(data, ["a", "b"]) == [1, 2]
+
+    def test_missing_key(self):
+        assert get_dict_value({"a": {"b": 1}}, ["a", "c"]) == []
+        assert get_dict_value({"a": [{"b": 1}]}, ["a", "c"]) == []
+
+
+class TestEtreeToDict:
+    def test_same_tag_siblings(self):
+        root = ElementTree.fromstring("<r><b>1</b><b>2</b><c/></r>")
+        assert etree_to_dict(root) == {"r": {"b": ["1", "2"], "c": None}}
+
+    def test_attributes_and_text(self):
+        root = ElementTree.fromstring('<r id="5"> hi </r>')
+        assert etree_to_dict(root) == {"r": {"@id": "5", "#text": "hi"}}
+
+    def test_text_leaf(self):
+        root = ElementTree.fromstring("<r><leaf>text</leaf></r>")
+        assert etree_to_dict(root) == {"r": {"leaf": "text"}}
+
+    def test_namespaced_root_no_prefix_strip(self):
+        root = ElementTree.fromstring(
+            '<n:r xmlns:n="http://x" n:id="5">hi<n:b>1</n:b></n:r>'
+        )
+        assert etree_to_dict(root, prefix_strip=False) == {
+            "{http://x}r": {"b": "1", "@id": "5", "#text": "hi"}
+        }
+
+
+class TestDetectDelimiter:
+    @pytest.mark.parametrize(
+        "filename,encoding,expected",
+        [
+            ("ru_utf8_comma.csv", "utf8", ","),
+            ("ru_utf8_semicolon.csv", "utf8", ";"),
+            ("ru_utf8_tab.csv", "utf8", "\t"),
+            ("ru_cp1251_comma.csv", "cp1251", ","),
+        ],
+    )
+    def test_fixtures(self, filename, encoding, expected):
+        path = os.path.join(FIXTURES_DIR, filename)
+        assert detect_delimiter(path, encoding=encoding) == expected
+
+    def test_multibyte_trail_byte(self, tmp_path):
+        # Second byte of "ポ" in Shift_JIS is 0x7C, same as "|"
+        path = tmp_path / "sjis.csv"
+        path.write_bytes(("ポイント,ポスト\n" + "ポ,ポ\n" * 20).encode("shift_jis"))
+        assert detect_delimiter(str(path), encoding="shift_jis") == ","
+
+    def test_no_encoding(self):
+        path = os.path.join(FIXTURES_DIR, "ru_utf8_semicolon.csv")
+        assert detect_delimiter(path, encoding=None) == ";"
+
+
+class TestDetectEncoding:
+    def test_ascii(self, tmp_path):
+        path = tmp_path / "ascii.csv"
+        path.write_bytes(b"id,name\n1,test\n")
+        assert detect_encoding(str(path))["encoding"] == "ascii"
+
+    def test_iso2022_jp_not_ascii(self, tmp_path):
+        # ISO-2022-JP is 7-bit but uses ESC sequences, must go to chardet
+        path = tmp_path / "jis.txt"
+        path.write_bytes(("日本語のテキストです。" * 30).encode("iso2022_jp"))
+        assert detect_encoding(str(path))["encoding"] == "ISO-2022-JP"
+
+    def test_utf16le_without_bom_not_ascii(self, tmp_path):
+        # Every other byte is NUL, still all below 0x80
+        path = tmp_path / "utf16le.csv"
+        path.write_bytes("id,name\n1,test\n2,hello\n".encode("utf-16-le") * 20)
+        assert detect_encoding(str(path))["encoding"] == "utf-16-le"
+
+    def test_binary_not_ascii(self):
+        path = os.path.join(FIXTURES_DIR, "2cols6rows_flat.bson")
+        assert detect_encoding(path)["encoding"] is None
+
+    def test_result_keys(self, tmp_path):
+        ascii_path = tmp_path / "ascii.csv"
+        ascii_path.write_bytes(b"id,name\n1,test\n")
+        bom_path = tmp_path / "bom.csv"
+        bom_path.write_bytes(b"\xef\xbb\xbfid,name\n1,test\n")
+        binary_path = os.path.join(FIXTURES_DIR, "2cols6rows_flat.bson")
+        keys = [
+            set(detect_encoding(str(path)))
+            for path in (ascii_path, bom_path, binary_path)
+        ]
+        assert keys[0] == keys[1] == keys[2]